@@ -0,0 +1,192 @@
+# Indexed channel directory.
+# SQLite replacement for the whole-catalog {category: {title: {chan_url, author}}} pickles,
+# so a worker can read one category (or look up one URL) without loading everything.
+
+import pickle
+import sqlite3
+from collections.abc import Mapping
+
+import channel_index
+
+
+directory_path = '../scraped/channel/directory.db'
+
+
+def open_directory(path=directory_path, readonly=False):
+    '''
+
+    Open (or create) the directory database.
+
+    Crawl workers should open it with readonly=True;
+    SQLite handles any number of concurrent readers.
+
+    '''
+
+    if readonly:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    else:
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS channels (
+                chan_id TEXT PRIMARY KEY,
+                chan_url TEXT NOT NULL,
+                title TEXT,
+                author TEXT
+            );
+            CREATE INDEX IF NOT EXISTS channels_url ON channels (chan_url);
+            CREATE INDEX IF NOT EXISTS channels_author ON channels (author);
+
+            CREATE TABLE IF NOT EXISTS listings (
+                category TEXT NOT NULL,
+                chan_id TEXT NOT NULL REFERENCES channels (chan_id),
+                title TEXT NOT NULL,
+                PRIMARY KEY (category, chan_id)
+            );
+            CREATE INDEX IF NOT EXISTS listings_chan ON listings (chan_id);
+
+            CREATE TABLE IF NOT EXISTS category_urls (
+                url TEXT PRIMARY KEY,
+                category TEXT
+            );
+        ''')
+        conn.commit()
+
+    return conn
+
+
+def upsert_category(conn, category, cat_dict):
+    '''
+
+    Bulk insert / update one category listing,
+    as returned by collect_category_pods or scrape_full_category_page.
+
+    '''
+
+    channels = []
+    listings = []
+    for title, info in cat_dict.items():
+        key = channel_index.chan_id(info['chan_url'])
+        channels += [(key, info['chan_url'], title, info.get('author'))]
+        listings += [(category, key, title)]
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO channels (chan_id, chan_url, title, author) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (chan_id) DO UPDATE SET chan_url = excluded.chan_url, '
+            'title = excluded.title, author = excluded.author', channels)
+        conn.executemany(
+            'INSERT OR REPLACE INTO listings (category, chan_id, title) VALUES (?, ?, ?)', listings)
+
+    return len(listings)
+
+
+def import_chan_dict(conn, chan_dict):
+    '''
+
+    Load a whole {category: {title: {chan_url, author}}} dict,
+    e.g. podcast_chan_dict-corrected-urls-v2.pickle, into the directory.
+
+    '''
+
+    if isinstance(chan_dict, str):
+        with open(chan_dict, 'rb') as file:
+            chan_dict = pickle.load(file)
+
+    return sum(upsert_category(conn, category, chan_dict[category]) for category in chan_dict)
+
+
+def add_category_urls(conn, urls, category=None):
+    '''
+    Store category page URLs, e.g. the valid_category_url_list pickle.
+    '''
+
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO category_urls (url, category) VALUES (?, ?)',
+                         [(url, category) for url in urls])
+
+
+def category_urls(conn):
+    return [row[0] for row in conn.execute('SELECT url FROM category_urls ORDER BY url')]
+
+
+def categories(conn):
+    return [row[0] for row in conn.execute('SELECT DISTINCT category FROM listings ORDER BY category')]
+
+
+def iter_category(conn, category):
+    '''
+
+    Yield (title, {'chan_url', 'author'}) for every channel listed in a category,
+    straight off the category index.
+
+    '''
+
+    rows = conn.execute(
+        'SELECT l.title, c.chan_url, c.author FROM listings l '
+        'JOIN channels c ON c.chan_id = l.chan_id WHERE l.category = ?', (category,))
+    for title, chan_url, author in rows:
+        yield title, {'chan_url': chan_url, 'author': author}
+
+
+def category_dict(conn, category):
+    '''
+    One category's {title: {chan_url, author}} dict.
+    '''
+
+    return dict(iter_category(conn, category))
+
+
+def lookup_url(conn, chan_url):
+    '''
+
+    Look up a channel by URL (any slug or query string).
+    Return {'chan_url', 'title', 'author', 'categories'}, or None.
+
+    '''
+
+    key = channel_index.chan_id(chan_url)
+    row = conn.execute('SELECT chan_url, title, author FROM channels WHERE chan_id = ?',
+                       (key,)).fetchone()
+    if row is None:
+        return None
+    cats = [r[0] for r in conn.execute('SELECT category FROM listings WHERE chan_id = ?', (key,))]
+
+    return {'chan_url': row[0], 'title': row[1], 'author': row[2], 'categories': cats}
+
+
+def by_author(conn, author):
+    '''
+    All channels by an author, as a {title: {chan_url, author}} dict.
+    '''
+
+    rows = conn.execute('SELECT title, chan_url, author FROM channels WHERE author = ?', (author,))
+    return {title: {'chan_url': chan_url, 'author': a} for title, chan_url, a in rows}
+
+
+class DirectoryView(Mapping):
+    '''
+
+    Read-only {category: {title: {chan_url, author}}} view of the directory,
+    so it can stand in for the pickled chan_dict. Categories are only
+    read from disk when asked for.
+
+    Example:
+    conn = open_directory(readonly=True)
+    scrape_all_pods_in_category(DirectoryView(conn), 'Arts', dr)
+
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getitem__(self, category):
+        cat_dict = category_dict(self.conn, category)
+        if not cat_dict:
+            raise KeyError(category)
+        return cat_dict
+
+    def __iter__(self):
+        return iter(categories(self.conn))
+
+    def __len__(self):
+        return len(categories(self.conn))
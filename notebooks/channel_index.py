@@ -0,0 +1,86 @@
+# Channel identity index.
+# The same podcast is listed under several Castbox categories,
+# so channels are keyed by the numeric id in their URL, not by title.
+
+import re
+from collections import defaultdict
+
+
+already_scraped_path = '../scraped/channel/already_scraped.csv'
+
+
+def chan_id(chan_url):
+    '''
+
+    Normalize a channel URL to its Castbox identity.
+
+    Channel URLs end in an `-id<number>` suffix, but the slug in front of it
+    varies (e.g. 'channel/99%-Invisible-id18' vs. 'channel/id18'),
+    and some carry a '?country=us' query string.
+
+    Example:
+    chan_id('https://castbox.fm/channel/Fresh-Air-id431951?country=us')
+        -> 'id431951'
+
+    If no id suffix is found, fall back on the URL without query string.
+
+    '''
+
+    url = str(chan_url).split('?')[0].rstrip('/')
+    match = re.search(r'(?:^|[-/])(id\d+)$', url)
+    if match:
+        return match.group(1)
+    return url
+
+
+def load_scraped_index(path=already_scraped_path):
+    '''
+
+    Build the channel -> set-of-categories map from the scrape log.
+
+    Each line of the log is 'chan_title,chan_url,category'.
+    Titles can contain commas, so split from the right.
+
+    '''
+
+    index = defaultdict(set)
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                parts = line.strip().rsplit(',', 2)
+                # skip fragments of titles that were logged with newlines
+                if len(parts) != 3 or not parts[1].startswith('http'):
+                    continue
+                index[chan_id(parts[1])].add(parts[2])
+    except FileNotFoundError:
+        pass
+
+    return index
+
+
+def record_scraped(index, chan_title, chan_url, category, path=already_scraped_path):
+    '''
+
+    Mark a channel as belonging to a category, in memory and in the scrape log.
+
+    '''
+
+    index[chan_id(chan_url)].add(category)
+    with open(path, 'a') as file:
+        file.write(str(chan_title) + ',' + str(chan_url) + ',' + str(category) + '\n')
+
+    return index
+
+
+def category_index(df, url_col='chan_url', category_col='category'):
+    '''
+
+    Build the channel -> set-of-categories map from a scraped dataframe.
+
+    '''
+
+    index = defaultdict(set)
+    for url, category in zip(df[url_col], df[category_col]):
+        index[chan_id(url)].add(category)
+
+    return index
@@ -0,0 +1,240 @@
+# Recrawl scheduler for channel pages.
+# Keeps per-channel scrape history in SQLite and hands out
+# the channels most due for a refresh.
+#
+# Each channel gets a `due_at` timestamp when it's scraped:
+# popular, fast-growing channels come due sooner, failing ones later.
+# `due_at` is indexed, so picking the next batch is an index range scan
+# (O(log n) plus the batch size) however large the catalog gets.
+
+import ast
+import datetime as dt
+import glob
+import math
+import os
+import re
+import sqlite3
+import time
+
+import channel_index
+
+
+schedule_path = '../scraped/channel/schedule.db'
+
+DAY = 24. * 60. * 60.
+
+base_interval = 14 * DAY    # an obscure, static channel
+min_interval = 0.5 * DAY
+max_interval = 90 * DAY
+
+
+def open_schedule(path=schedule_path):
+    '''
+
+    Open (or create) the schedule database.
+
+    '''
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schedule (
+            chan_id TEXT PRIMARY KEY,
+            chan_url TEXT NOT NULL,
+            title TEXT,
+            category TEXT,
+            last_scraped REAL,
+            sub_count INTEGER,
+            play_count INTEGER,
+            sub_velocity REAL DEFAULT 0,
+            play_velocity REAL DEFAULT 0,
+            failures INTEGER DEFAULT 0,
+            due_at REAL NOT NULL DEFAULT 0
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS schedule_due_at ON schedule (due_at)')
+    conn.commit()
+
+    return conn
+
+
+# timestamp of a 'processed features' entry in the scrape log
+processed_pattern = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+) - processed features on page')
+
+
+def load_scrape_history(by_category_dir='../scraped/channel/by_category',
+                        log_path='../logs/scrape_log.txt'):
+    '''
+
+    What we already know about previously scraped channels:
+    {chan_id: {'last_scraped', 'sub_count', 'play_count'}}.
+
+    Scrape times come from the scrape log (the last time features were
+    processed for the channel), falling back on the modification time of
+    the category file it was exported to. Counts come from the exported
+    category files.
+
+    '''
+
+    history = {}
+
+    for path in glob.glob(os.path.join(by_category_dir, '*.txt')):
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    pod_dict = ast.literal_eval(line)
+                    features = list(pod_dict.values())[0]
+                    key = channel_index.chan_id(features['chan_url'])
+                except Exception:
+                    continue
+                history[key] = {'last_scraped': mtime,
+                                'sub_count': features.get('sub_count'),
+                                'play_count': features.get('play_count')}
+
+    try:
+        with open(log_path, 'r') as file:
+            chan = None
+            for line in file:
+                if line.startswith('Now scraping '):
+                    chan = channel_index.chan_id(line[len('Now scraping '):].strip())
+                    continue
+                match = processed_pattern.search(line)
+                if chan in history and match:
+                    history[chan]['last_scraped'] = dt.datetime.strptime(
+                        match.group(1), '%Y-%m-%d %H:%M:%S.%f').timestamp()
+    except FileNotFoundError:
+        pass
+
+    return history
+
+
+def add_channels(conn, chan_dict, history=None):
+    '''
+
+    Register every channel of a {category: {title: {'chan_url', 'author'}}} dict.
+
+    Channels found in `history` (default: load_scrape_history()) are seeded
+    with their last scrape time and counts, and come due after their
+    refresh_interval. Only channels never scraped before are due immediately.
+    Known channels are left alone.
+
+    '''
+
+    if history is None:
+        history = load_scrape_history()
+
+    rows = []
+    for category in chan_dict:
+        for title, info in chan_dict[category].items():
+            key = channel_index.chan_id(info['chan_url'])
+            seen = history.get(key)
+            if seen is None:
+                rows += [(key, info['chan_url'], title, category, None, None, None, 0)]
+                continue
+            due_at = seen['last_scraped'] + refresh_interval(
+                seen['sub_count'], seen['play_count'], 0, 0, 0)
+            rows += [(key, info['chan_url'], title, category, seen['last_scraped'],
+                      seen['sub_count'], seen['play_count'], due_at)]
+
+    with conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO schedule (chan_id, chan_url, title, category, '
+            'last_scraped, sub_count, play_count, due_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    return len(rows)
+
+
+def refresh_interval(sub_count, play_count, sub_velocity, play_velocity, failures):
+    '''
+
+    Seconds to wait before scraping a channel again.
+
+    Shrinks with popularity (log of subscribers) and with growth
+    (daily play/subscriber gain relative to the current count),
+    and doubles for every consecutive failure.
+
+    '''
+
+    popularity = math.log10(1 + max(sub_count or 0, 0))
+    growth = (max(play_velocity or 0, 0) / max(play_count or 0, 1)
+              + max(sub_velocity or 0, 0) / max(sub_count or 0, 1)) * DAY
+
+    interval = base_interval / (1 + popularity / 2 + 50 * growth)
+    interval *= 2 ** min(failures, 6)
+
+    return min(max(interval, min_interval), max_interval)
+
+
+def record_scrape(conn, chan_url, features, now=None):
+    '''
+
+    Update a channel's history after a successful scrape and reschedule it.
+
+    Velocities are per-second changes in sub_count / play_count
+    since the previous scrape.
+
+    '''
+
+    now = now or time.time()
+    key = channel_index.chan_id(chan_url)
+    prev = conn.execute('SELECT * FROM schedule WHERE chan_id = ?', (key,)).fetchone()
+
+    sub_count = features.get('sub_count', 0)
+    play_count = features.get('play_count', 0)
+    sub_velocity = play_velocity = 0.
+    if prev is not None and prev['last_scraped'] and now > prev['last_scraped']:
+        elapsed = now - prev['last_scraped']
+        sub_velocity = (sub_count - (prev['sub_count'] or 0)) / elapsed
+        play_velocity = (play_count - (prev['play_count'] or 0)) / elapsed
+
+    due_at = now + refresh_interval(sub_count, play_count, sub_velocity, play_velocity, 0)
+
+    with conn:
+        conn.execute(
+            'INSERT INTO schedule (chan_id, chan_url, title, category, last_scraped, sub_count, '
+            'play_count, sub_velocity, play_velocity, failures, due_at) '
+            'VALUES (?, ?, ?, NULL, ?, ?, ?, ?, ?, 0, ?) '
+            'ON CONFLICT (chan_id) DO UPDATE SET '
+            'last_scraped = excluded.last_scraped, sub_count = excluded.sub_count, '
+            'play_count = excluded.play_count, sub_velocity = excluded.sub_velocity, '
+            'play_velocity = excluded.play_velocity, failures = 0, due_at = excluded.due_at',
+            (key, chan_url, features.get('title'), now, sub_count, play_count,
+             sub_velocity, play_velocity, due_at))
+
+
+def record_failure(conn, chan_url, now=None):
+    '''
+
+    Count a failed scrape and push the channel back.
+
+    '''
+
+    now = now or time.time()
+    key = channel_index.chan_id(chan_url)
+    row = conn.execute('SELECT * FROM schedule WHERE chan_id = ?', (key,)).fetchone()
+    if row is None:
+        return
+
+    failures = row['failures'] + 1
+    due_at = now + refresh_interval(row['sub_count'], row['play_count'],
+                                    row['sub_velocity'], row['play_velocity'], failures)
+    with conn:
+        conn.execute('UPDATE schedule SET failures = ?, due_at = ? WHERE chan_id = ?',
+                     (failures, due_at, key))
+
+
+def next_batch(conn, budget, now=None):
+    '''
+
+    Return up to `budget` channels that are due, most overdue first,
+    as a list of dicts with chan_url, title and category.
+
+    '''
+
+    now = now or time.time()
+    rows = conn.execute(
+        'SELECT chan_url, title, category FROM schedule '
+        'WHERE due_at <= ? ORDER BY due_at LIMIT ?', (now, budget)).fetchall()
+
+    return [dict(row) for row in rows]
@@ -14,6 +14,8 @@ import numpy as np
 import ast
 import tldextract
 
+import channel_index
+import profiling
 
 
 def convert_ep_date(string):
@@ -207,7 +209,13 @@ def sanitize(df):
     
     return df
 
-def raw_to_df(cat_name):
+def raw_to_df(cat_name, export=True):
+    '''
+    
+    Load a category's scraped .txt file into a sanitized dataframe.
+    With export=True, also save it as a .pickle next to the .txt file.
+    
+    '''
     
     cat_dict = {}
     
@@ -220,7 +228,9 @@ def raw_to_df(cat_name):
             try:
                 pod_dict = ast.literal_eval(line)
                 chan_name = [k for k in pod_dict.keys()][0]
-                cat_dict[chan_name] = pod_dict[chan_name]
+                # key by channel identity, since titles aren't unique
+                chan_key = channel_index.chan_id(pod_dict[chan_name].get('chan_url', chan_name))
+                cat_dict[chan_key] = pod_dict[chan_name]
             except:
                 continue
         
@@ -231,36 +241,66 @@ def raw_to_df(cat_name):
     # various sanitation tasks
     df = sanitize(df)
 
-    export_path = '../scraped/channel/by_category/' + cat_name + '.pickle'
-    with open(export_path, 'wb') as file:
-        pickle.dump(df, file)
+    if export:
+        export_path = '../scraped/channel/by_category/' + cat_name + '.pickle'
+        with open(export_path, 'wb') as file:
+            pickle.dump(df, file)
     
     return df
 
 
-def merge_raw_data(scraped_categories):
+def merge_raw_data(scraped_categories, scraped_log=channel_index.already_scraped_path):
     '''
     
     Take a list of scraped categories in its directory,
-    and append 
+    and merge them into one dataframe with one row per channel
+    (see merge_category_dfs).
     
     '''
     
-    # append other dataframes to base dataframe
+    dfs = []
     for scraped in scraped_categories:
         
-        next_df = ft.raw_to_df(scraped)
+        next_df = raw_to_df(scraped)
         print(f'loaded {scraped} with size {next_df.shape}')
+        dfs += [next_df]
         
-        try:
-            print('appending... ', scraped)
-            df = df.append(next_df)
-        except:
-            print('first dataframe... ', scraped)
-            df = next_df.copy()
-        
-        print(f'dataframe now has size {df.shape}')
-        
+    return merge_category_dfs(dfs, scraped_log)
+
+
+def merge_category_dfs(dfs, scraped_log=channel_index.already_scraped_path):
+    '''
+    
+    Merge sanitized category dataframes (from raw_to_df)
+    into one dataframe with one row per channel.
+    
+    A channel listed under several categories is only kept once.
+    Its categories are collected in the `categories` column,
+    and spread out as multi-hot `cat_<category>` columns.
+    The scrape log is consulted too, since the crawler records
+    extra category memberships without re-scraping the channel.
+    
+    '''
+    
+    df = pd.concat(dfs, ignore_index=True, sort=False)
+    print(f'dataframe has size {df.shape} before deduplication')
+    
+    df['chan_id'] = df.chan_url.apply(channel_index.chan_id)
+    
+    # channel id -> set of categories
+    cat_index = channel_index.category_index(df)
+    for chan, cats in channel_index.load_scraped_index(scraped_log).items():
+        if chan in cat_index:
+            cat_index[chan] |= cats
+    
+    df = df.drop_duplicates(subset='chan_id', keep='first').reset_index(drop=True)
+    df['categories'] = df.chan_id.apply(lambda c: sorted(cat_index[c]))
+    
+    multi_hot = df.categories.apply('|'.join).str.get_dummies(sep='|')
+    multi_hot.columns = ['cat_' + re.sub(r'\W+', '_', c) for c in multi_hot.columns]
+    df = pd.concat([df, multi_hot], axis=1)
+    
+    print(f'dataframe now has size {df.shape}')
         
     return df
 
@@ -326,6 +366,28 @@ def extract_domain(site):
         return ''
     
 
+def add_growth_targets(df, store, start, end, metrics=('sub_count', 'play_count'), per_day=True):
+    '''
+    
+    Add `<metric>_growth` columns from a snapshot_store.SnapshotStore:
+    the change in each metric over the [start, end] window, per day by default.
+    
+    Channels that weren't observed by `start` get NaN.
+    
+    Example:
+    store = snapshot_store.SnapshotStore.load()
+    df = add_growth_targets(df, store, '2019-10-01', '2019-10-08')
+    
+    '''
+    
+    chan_ids = df.chan_url.apply(channel_index.chan_id)
+    for metric in metrics:
+        growth = store.growth_frame(metric, start, end, per_day=per_day)
+        df[metric + '_growth'] = chan_ids.map(growth).values
+    
+    return df
+
+
 def build_features(df, feature_set='episode'):
     '''
     
@@ -395,3 +457,6 @@ def build_features(df, feature_set='episode'):
     
     
     return df
+
+
+profiling.instrument_module(sys.modules[__name__], extras=['ast.literal_eval'])
@@ -0,0 +1,367 @@
+# End-to-end pipeline runner.
+# Replaces stepping through the notebooks and reloading pickles by hand:
+# each stage's output is cached, keyed by a fingerprint of its code and inputs,
+# and only stages whose inputs or code changed are re-run.
+#
+#   discover_categories -> crawl_categories -> crawl_channels -> sanitize -> merge
+#   merge -> episode_features \
+#   merge -> social_features  -> join -> fit
+#
+# Run from the notebooks directory (paths are relative, like everywhere else):
+#
+#   python pipeline.py                  # bring everything up to date
+#   python pipeline.py --until merge    # stop after the merge stage
+#   python pipeline.py --force sanitize # re-run sanitize and everything after it
+#   python pipeline.py --crawl          # re-scrape Castbox instead of reading scraped files
+#   python pipeline.py --list           # show stages and whether they're cached
+
+import argparse
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+cache_dir = '../scraped/cache'
+
+# name -> {'func', 'deps', 'files', 'code', 'local'}
+stages = {}
+
+
+def stage(name, deps=(), files=None, code=(), local=False):
+    '''
+
+    Register a pipeline stage.
+
+    deps:  upstream stages; their outputs are passed to the stage function,
+           after the params dict, in this order
+    files: function of params returning the input files the stage reads
+           directly, whose contents are part of the cache key
+    code:  module names whose source is part of the cache key
+    local: run in the main process (e.g. stages that drive a browser)
+
+    '''
+
+    def register(func):
+        stages[name] = {'func': func, 'deps': list(deps), 'files': files,
+                        'code': list(code), 'local': local}
+        return func
+    return register
+
+
+def _open_driver():
+    from selenium import webdriver
+    import webscraping
+    return webdriver.Chrome(webscraping.chromedriver)
+
+
+##### stages #####
+
+@stage('discover_categories', code=['webscraping'], local=True,
+       files=lambda params: [] if params['crawl'] else ['../scraped/category/valid_category_url_list.pickle'])
+def discover_categories(params):
+    import webscraping
+    if params['crawl']:
+        return webscraping.scan_for_valid_category_category_urls()
+    with open('../scraped/category/valid_category_url_list.pickle', 'rb') as file:
+        return pickle.load(file)
+
+
+@stage('crawl_categories', deps=['discover_categories'], code=['webscraping'], local=True,
+       files=lambda params: [] if params['crawl'] else ['../scraped/channel/podcast_chan_dict-corrected-urls-v2.pickle'])
+def crawl_categories(params, category_urls):
+    import webscraping
+    if not params['crawl']:
+        with open('../scraped/channel/podcast_chan_dict-corrected-urls-v2.pickle', 'rb') as file:
+            return pickle.load(file)
+
+    chan_dict = {}
+    dr = _open_driver()
+    try:
+        for url in category_urls:
+            category_name, category_dict = webscraping.scrape_full_category_page(url, dr)
+            chan_dict[category_name] = category_dict
+    finally:
+        dr.quit()
+    return chan_dict
+
+
+@stage('crawl_channels', deps=['crawl_categories'], code=['webscraping'], local=True,
+       files=lambda params: [] if params['crawl'] else
+           sorted(glob.glob('../scraped/channel/by_category/*.txt')) + ['../scraped/channel/already_scraped.csv'])
+def crawl_channels(params, chan_dict):
+    import webscraping
+    if params['crawl']:
+        dr = _open_driver()
+        try:
+            for category in chan_dict:
+                webscraping.scrape_all_pods_in_category(chan_dict, category, dr, export=True)
+        finally:
+            dr.quit()
+
+    # the scraped categories, as named by their .txt files
+    return sorted(os.path.basename(path)[:-len('.txt')]
+                  for path in glob.glob('../scraped/channel/by_category/*.txt'))
+
+
+@stage('sanitize', deps=['crawl_channels'], code=['features', 'channel_index'])
+def sanitize(params, categories):
+    import features
+    # no export: the cached output is the only thing this stage writes
+    return [features.raw_to_df(category, export=False) for category in categories]
+
+
+@stage('merge', deps=['sanitize'], code=['features', 'channel_index'],
+       files=lambda params: ['../scraped/channel/already_scraped.csv'])
+def merge(params, category_dfs):
+    import features
+    return features.merge_category_dfs(category_dfs)
+
+
+@stage('episode_features', deps=['merge'], code=['features'])
+def episode_features(params, df):
+    import features
+    new = features.build_features(df.copy(), feature_set='episode')
+    return new[[col for col in new.columns if col not in df.columns]]
+
+
+@stage('social_features', deps=['merge'], code=['features'],
+       files=lambda params: ['../social_metrics/twitter/channel_stats_by_name_oct8_2p.pickle'])
+def social_features(params, df):
+    import features
+    new = features.build_features(df.copy(), feature_set='social')
+    return new[[col for col in new.columns if col not in df.columns]]
+
+
+@stage('join', deps=['merge', 'episode_features', 'social_features'])
+def join(params, df, episode, social):
+    return df.join(episode).join(social)
+
+
+# predictors, as named by build_features
+reg_cols = ['isExplicit', 'ep_total',
+            'recent_ep_spacing', 'lifetime_ep_freq', 'avg_ep_len', 'chan_age',
+            'has_twitter', 'has_facebook', 'has_youtube', 'has_instagram', 'twitter_followers']
+
+
+@stage('fit', deps=['join'])
+def fit(params, df):
+    '''
+    Ridge regression of play_count, as in regression_and_cross_validation.
+    '''
+
+    from sklearn.linear_model import Ridge
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    cols = [col for col in reg_cols if col in df.columns]
+    reg_df = df[df.ep_total != 0].dropna(subset=cols + ['play_count'])
+    reg_df = reg_df.loc[(reg_df.play_count < 10000000.0) & (reg_df.play_count > 50)]
+
+    X = reg_df[cols].astype(float).values
+    y = reg_df.play_count.values
+
+    X_non_test, X_test, y_non_test, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_val, y_train, y_val = train_test_split(X_non_test, y_non_test, test_size=0.2, random_state=42)
+
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+
+    ridge_reg = Ridge(alpha=10000)
+    ridge_reg.fit(X_train_scaled, y_train)
+
+    results = {'rows': len(reg_df),
+               'val_r2': ridge_reg.score(scaler.transform(X_val), y_val),
+               'test_r2': ridge_reg.score(scaler.transform(X_test), y_test),
+               'coef': dict(zip(cols, ridge_reg.coef_))}
+    print(f'Ridge Regression val R^2: {results["val_r2"]:.3f}')
+    return results
+
+
+##### running #####
+
+def _hash_file(path, h):
+    h.update(path.encode())
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                h.update(chunk)
+    except FileNotFoundError:
+        h.update(b'<missing>')
+
+
+def _code_hash(name, h):
+    h.update(inspect.getsource(stages[name]['func']).encode())
+    for module in stages[name]['code']:
+        _hash_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), module + '.py'), h)
+
+
+def stage_keys(names, params):
+    '''
+
+    Cache key of every stage: its code, its parameters, its input files,
+    and the keys of its upstream stages.
+
+    '''
+
+    keys = {}
+    for name in names:
+        h = hashlib.sha256(name.encode())
+        _code_hash(name, h)
+        h.update(repr(sorted(params.items())).encode())
+        if params['crawl'] and stages[name]['local']:
+            # a live crawl is never a cache hit
+            h.update(str(time.time()).encode())
+        files = stages[name]['files']
+        for path in (files(params) if files else []):
+            _hash_file(path, h)
+        for dep in stages[name]['deps']:
+            h.update(keys[dep].encode())
+        keys[name] = h.hexdigest()[:16]
+    return keys
+
+
+def cache_path(name, key):
+    return os.path.join(cache_dir, f'{name}-{key}.pickle')
+
+
+def topological(targets):
+    '''
+    The targets and everything upstream of them, dependencies first.
+    '''
+
+    order = []
+    def visit(name):
+        if name in order:
+            return
+        for dep in stages[name]['deps']:
+            visit(dep)
+        order.append(name)
+    for name in targets:
+        visit(name)
+    return order
+
+
+def downstream(names, within):
+    found = set(names)
+    for name in within:
+        if any(dep in found for dep in stages[name]['deps']):
+            found.add(name)
+    return found
+
+
+def _run_stage(name, params, inputs):
+    start = time.perf_counter()
+    output = stages[name]['func'](params, *inputs)
+    return output, time.perf_counter() - start
+
+
+def run(until=None, force=(), params=None, jobs=2):
+    '''
+
+    Run the pipeline up to `until` (default: every stage), skipping cached stages.
+    Independent stages run in parallel worker processes.
+
+    Return the output of the last stage and a {stage: (status, seconds)} timing dict.
+
+    '''
+
+    params = dict({'crawl': False}, **(params or {}))
+    order = topological([until] if until else list(stages))
+    keys = stage_keys(order, params)
+    forced = downstream(force, order)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    to_run = [name for name in order
+              if name in forced or not os.path.exists(cache_path(name, keys[name]))]
+
+    outputs = {}
+    def output_of(name):
+        if name not in outputs:
+            with open(cache_path(name, keys[name]), 'rb') as file:
+                outputs[name] = pickle.load(file)
+        return outputs[name]
+
+    timings = {name: ('cached', 0.) for name in order if name not in to_run}
+    pending = list(to_run)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        while pending or running:
+
+            ran_locally = False
+            ready = [name for name in pending
+                     if not any(dep in pending or dep in running.values() for dep in stages[name]['deps'])]
+            for name in ready:
+                pending.remove(name)
+                inputs = [output_of(dep) for dep in stages[name]['deps']]
+                print(f'[pipeline] running {name}')
+                if stages[name]['local'] or jobs <= 1:
+                    output, seconds = _run_stage(name, params, inputs)
+                    _finish(name, keys[name], output, seconds, outputs, timings)
+                    ran_locally = True
+                else:
+                    running[pool.submit(_run_stage, name, params, inputs)] = name
+
+            if ran_locally or not running:
+                # finished stages may have unblocked others
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                output, seconds = future.result()
+                _finish(name, keys[name], output, seconds, outputs, timings)
+
+    return output_of(order[-1]), {name: timings[name] for name in order}
+
+
+def _finish(name, key, output, seconds, outputs, timings):
+    with open(cache_path(name, key), 'wb') as file:
+        pickle.dump(output, file)
+    outputs[name] = output
+    timings[name] = ('ran', seconds)
+    print(f'[pipeline] finished {name} in {seconds:.1f}s')
+
+
+def report(timings):
+    lines = [f'{"stage":<20} {"status":<7} {"seconds":>8}']
+    for name, (status, seconds) in timings.items():
+        lines += [f'{name:<20} {status:<7} {seconds:>8.1f}']
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the podcast popularity pipeline.')
+    parser.add_argument('--until', choices=list(stages), help='last stage to run (default: all)')
+    parser.add_argument('--force', nargs='*', default=[], choices=list(stages),
+                        help='re-run these stages and everything downstream of them')
+    parser.add_argument('--crawl', action='store_true',
+                        help='re-scrape Castbox instead of using the scraped files on disk')
+    parser.add_argument('--jobs', type=int, default=2, help='parallel worker processes')
+    parser.add_argument('--list', action='store_true', help='list stages and cache status')
+    args = parser.parse_args(argv)
+
+    params = {'crawl': args.crawl}
+
+    if args.list:
+        order = topological([args.until] if args.until else list(stages))
+        keys = stage_keys(order, params)
+        for name in order:
+            cached = os.path.exists(cache_path(name, keys[name]))
+            deps = ', '.join(stages[name]['deps'])
+            print(f'{name:<20} {"cached" if cached else "stale":<7} <- {deps}')
+        return
+
+    start = time.perf_counter()
+    output, timings = run(args.until, args.force, params, args.jobs)
+    print()
+    print(report(timings))
+    print(f'total: {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# Opt-in profiling for the scraper and feature pipeline.
+#
+# Off by default, and free when off: nothing is wrapped unless profiling is
+# enabled, either with the PODCAST_PROFILE=1 environment variable (before the
+# modules are imported) or by calling profiling.enable() in a notebook.
+#
+#   PODCAST_PROFILE=1           time every public function in instrumented modules
+#   PODCAST_PROFILE_MEMORY=1    also sample peak traced memory of top-level calls
+#   PODCAST_PROFILE_DIR=path    dump cProfile stats per top-level stage,
+#                               and collapsed stacks for flame graphs
+
+import atexit
+import cProfile
+import functools
+import inspect
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+
+enabled = os.environ.get('PODCAST_PROFILE', '') not in ('', '0')
+memory = os.environ.get('PODCAST_PROFILE_MEMORY', '') not in ('', '0')
+dump_dir = os.environ.get('PODCAST_PROFILE_DIR') or None
+
+# module name -> (module, extras) for everything instrument_module has seen
+registered = {}
+
+# name -> {'calls', 'total', 'own', 'peak_mem'}
+stats = defaultdict(lambda: {'calls': 0, 'total': 0., 'own': 0., 'peak_mem': 0})
+# 'outer;inner;innermost' -> own seconds, for flame graphs
+collapsed = defaultdict(float)
+# top-level stage name -> cProfile.Profile
+profilers = {}
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable(track_memory=None, profile_dir=None):
+    '''
+
+    Turn profiling on at runtime and instrument every registered module.
+
+    '''
+
+    global enabled, memory, dump_dir
+    enabled = True
+    if track_memory is not None:
+        memory = track_memory
+    if profile_dir is not None:
+        dump_dir = profile_dir
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    for module, extras in list(registered.values()):
+        _wrap_module(module, extras)
+
+
+def reset():
+    with _lock:
+        stats.clear()
+        collapsed.clear()
+        profilers.clear()
+
+
+##### wrapping #####
+
+def timed(func, name=None):
+    '''
+
+    Wrap a callable so each call is timed under `name`.
+
+    Inclusive time goes to 'total', time not spent in other timed calls
+    goes to 'own'. Top-level calls (nothing timed above them on this thread)
+    are also where memory is sampled and cProfile runs.
+
+    '''
+
+    name = name or func.__module__ + '.' + func.__qualname__
+    if getattr(func, '_profiled', False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        top_level = len(stack) == 0
+
+        profiler = None
+        if top_level:
+            if memory and tracemalloc.is_tracing():
+                mem_before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            if dump_dir:
+                with _lock:
+                    profiler = profilers.setdefault(name, cProfile.Profile())
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # another profiler is already running on this interpreter
+                    profiler = None
+
+        # [name, seconds spent in timed children]
+        frame = [name, 0.]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            if profiler is not None:
+                profiler.disable()
+
+            own = elapsed - frame[1]
+            path = ';'.join(f[0] for f in stack) + (';' if stack else '') + name
+            with _lock:
+                s = stats[name]
+                s['calls'] += 1
+                s['total'] += elapsed
+                s['own'] += own
+                collapsed[path] += own
+                if top_level and memory and tracemalloc.is_tracing():
+                    peak = tracemalloc.get_traced_memory()[1] - mem_before
+                    s['peak_mem'] = max(s['peak_mem'], peak)
+
+    wrapper._profiled = True
+    return wrapper
+
+
+class _AttributeProxy:
+    '''
+    Stand-in for an imported module with some attributes replaced,
+    e.g. `time` with a timed `time.sleep`.
+    '''
+
+    def __init__(self, target, overrides):
+        self._target = target
+        self._overrides = overrides
+
+    def __getattr__(self, attr):
+        if attr in self._overrides:
+            return self._overrides[attr]
+        return getattr(self._target, attr)
+
+
+def _wrap_module(module, extras):
+    namespace = vars(module)
+    for attr, obj in list(namespace.items()):
+        if attr.startswith('_') or not inspect.isfunction(obj):
+            continue
+        if obj.__module__ != module.__name__ or inspect.isgeneratorfunction(obj):
+            # imported helpers are timed in their own module;
+            # a generator's time is spent by whoever iterates it
+            continue
+        namespace[attr] = timed(obj)
+
+    # third-party hot spots, named as they are called in the module
+    for dotted in extras:
+        head, _, tail = dotted.partition('.')
+        if head not in namespace:
+            continue
+        if not tail:
+            namespace[head] = timed(namespace[head], dotted)
+            continue
+        target = namespace[head]
+        overrides = dict(getattr(target, '_overrides', {}))
+        base = getattr(target, '_target', target)
+        overrides[tail] = timed(getattr(base, tail), dotted)
+        namespace[head] = _AttributeProxy(base, overrides)
+
+
+def instrument_module(module, extras=()):
+    '''
+
+    Register a module for profiling, and wrap its public functions
+    (and any `extras`, like 'BeautifulSoup' or 'time.sleep') if profiling is on.
+
+    Call at the bottom of the module:
+    profiling.instrument_module(sys.modules[__name__], extras=['time.sleep'])
+
+    '''
+
+    registered[module.__name__] = (module, tuple(extras))
+    if enabled:
+        _wrap_module(module, extras)
+
+
+def instrument_driver(dr):
+    '''
+
+    Time page loads of a selenium web driver as 'dr.get'.
+    A no-op unless profiling is on.
+
+    '''
+
+    if enabled and not getattr(dr.get, '_profiled', False):
+        dr.get = timed(dr.get, 'dr.get')
+    return dr
+
+
+##### reporting #####
+
+def report(top=20, sort_by='own'):
+    '''
+
+    Rank the hot paths, by own time by default, and return the table as a string.
+    Also writes cProfile stats and collapsed stacks if a dump directory is set.
+
+    '''
+
+    with _lock:
+        rows = sorted(stats.items(), key=lambda kv: kv[1][sort_by], reverse=True)[:top]
+        total_own = sum(s['own'] for s in stats.values()) or 1.
+
+    lines = [f'{"function":<48} {"calls":>7} {"total s":>9} {"own s":>9} {"own %":>6} {"peak MB":>8}']
+    for name, s in rows:
+        lines += [f'{name[-48:]:<48} {s["calls"]:>7} {s["total"]:>9.3f} {s["own"]:>9.3f} '
+                  f'{100 * s["own"] / total_own:>6.1f} {s["peak_mem"] / 2**20:>8.1f}']
+    table = '\n'.join(lines)
+
+    if dump_dir:
+        dump(dump_dir)
+
+    return table
+
+
+def dump(path):
+    '''
+    Write <stage>.prof cProfile stats per top-level stage, and collapsed.txt.
+    '''
+
+    os.makedirs(path, exist_ok=True)
+    with _lock:
+        for name, profiler in profilers.items():
+            profiler.dump_stats(os.path.join(path, name + '.prof'))
+        with open(os.path.join(path, 'collapsed.txt'), 'w') as file:
+            for stack_path, seconds in sorted(collapsed.items()):
+                # flamegraph.pl wants integer sample counts; use microseconds
+                file.write(f'{stack_path} {int(seconds * 1e6)}\n')
+
+
+def _report_at_exit():
+    if enabled and stats:
+        print(report())
+
+
+atexit.register(_report_at_exit)
+
+if enabled and memory:
+    tracemalloc.start()
@@ -0,0 +1,143 @@
+# Retry policy for channel scrapes.
+# Classifies scrape failures, spaces out retries,
+# and pauses the crawl when a host starts throttling us.
+
+import random
+import sys
+import time
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import WebDriverException
+
+import profiling
+
+
+# failure kinds
+MISSING_ELEMENT = 'missing_element'  # an expected div wasn't on the page
+BAD_EP_TOTAL = 'bad_ep_total'        # episode total scraped as non-integer
+NO_RECENT_EPS = 'no_recent_eps'      # episode list hadn't rendered
+DRIVER_ERROR = 'driver_error'        # browser / network level failure
+UNKNOWN = 'unknown'
+
+# Failures a fresh page load could plausibly fix.
+# Anything else is a bug in the parser, and retrying won't help.
+REFETCH_KINDS = {MISSING_ELEMENT, BAD_EP_TOTAL, NO_RECENT_EPS, DRIVER_ERROR}
+
+# Failures that point at the host (throttling, network trouble) rather than one channel's page.
+# Only these count toward the circuit breaker.
+THROTTLE_KINDS = {DRIVER_ERROR}
+
+
+class ScrapeFailure(Exception):
+    '''
+    Raised by the channel parser with the kind of failure it ran into.
+    '''
+
+    def __init__(self, kind, message=''):
+        super().__init__(message)
+        self.kind = kind
+
+
+def classify_failure(exc):
+    '''
+
+    Map an exception raised while fetching or parsing a channel
+    to one of the failure kinds above.
+
+    '''
+
+    if isinstance(exc, ScrapeFailure):
+        return exc.kind
+    if isinstance(exc, WebDriverException):
+        return DRIVER_ERROR
+    if isinstance(exc, (AttributeError, IndexError, TypeError, ValueError)):
+        # soup.find() returned None, or a counter div held no number
+        return MISSING_ELEMENT
+    return UNKNOWN
+
+
+def should_refetch(kind):
+    return kind in REFETCH_KINDS
+
+
+def is_throttling(kind):
+    return kind in THROTTLE_KINDS
+
+
+def backoff_delay(attempt, base=1., cap=30.):
+    '''
+
+    Exponential backoff with full jitter:
+    a random wait in [0, min(cap, base * 2**attempt)] seconds.
+
+    '''
+
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    '''
+
+    Per-host circuit breaker.
+
+    Only host-level failures (see THROTTLE_KINDS) should be recorded.
+    After `threshold` consecutive failures the circuit opens,
+    and `wait()` blocks until `cooldown` seconds have passed.
+    The next request is a trial: success closes the circuit,
+    failure opens it again, with the cooldown doubled (up to `max_cooldown`).
+
+    '''
+
+    def __init__(self, threshold=5, cooldown=60., max_cooldown=900.):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        self.failures += 1
+        if self.is_open():
+            # trial request failed; back off harder
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self.opened_at = time.time()
+        elif self.failures >= self.threshold:
+            self.opened_at = time.time()
+
+    def wait(self):
+        '''
+        Block while the circuit is open.
+        '''
+
+        if not self.is_open():
+            return
+        remaining = self.opened_at + self.cooldown - time.time()
+        if remaining > 0:
+            print(f'{self.failures} failures in a row, pausing crawl for {remaining:.0f}s')
+            time.sleep(remaining)
+
+
+breakers = {}
+
+def get_breaker(url):
+    '''
+    Return the circuit breaker shared by all requests to the host of `url`.
+    '''
+
+    host = urlparse(url).netloc
+    if host not in breakers:
+        breakers[host] = CircuitBreaker()
+    return breakers[host]
+
+
+# circuit breaker pauses (up to max_cooldown) show up as time.sleep
+profiling.instrument_module(sys.modules[__name__], extras=['time.sleep'])
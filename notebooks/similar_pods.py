@@ -0,0 +1,198 @@
+# Similar-podcast lookup.
+# Embeds every channel as a float32 vector (scaled numeric features + chan_desc text)
+# and answers "which shows are most like this one?" with a vectorized cosine search.
+
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import StandardScaler
+
+import channel_index
+
+
+index_path = '../scraped/merged/similarity_index.pickle'
+
+# numeric columns of a build_features() dataframe
+numeric_cols = ['num_comments', 'isExplicit', 'sub_count', 'play_count', 'ep_total',
+                'recent_ep_spacing', 'lifetime_ep_freq', 'avg_ep_len', 'chan_age']
+
+# heavy-tailed counts are compared on a log scale
+log_cols = ['num_comments', 'sub_count', 'play_count', 'ep_total']
+
+
+class SimilarityIndex:
+    '''
+
+    Nearest-neighbor index over channel features.
+
+    Each channel is the concatenation of its standardized numeric features
+    and an LSA embedding (TF-IDF + truncated SVD) of its description,
+    L2-normalized so a single matrix-vector product gives cosine similarity
+    against the whole catalog. Rows live in a preallocated float32 buffer
+    that doubles when full, so inserting new channels is cheap.
+
+    Usage:
+
+    df = features.build_features(df)
+    index = SimilarityIndex().fit(df)
+    index.most_similar('99% Invisible', k=10)
+    index.add(newly_scraped_df)
+    index.save()
+
+    '''
+
+    def __init__(self, text_dims=64, text_weight=1., numeric_cols=numeric_cols):
+        self.text_dims = text_dims
+        self.text_weight = text_weight
+        self.numeric_cols = list(numeric_cols)
+
+        self.scaler = StandardScaler()
+        self.vectorizer = TfidfVectorizer(stop_words='english', max_features=20000,
+                                          sublinear_tf=True)
+        self.svd = TruncatedSVD(n_components=text_dims, random_state=42)
+
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.size = 0
+        self.chans = []        # row -> channel id
+        self.titles = []       # row -> title
+        self.urls = []         # row -> chan_url
+        self.rows = {}         # channel id -> row
+
+    @classmethod
+    def load(cls, path=index_path):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    def save(self, path=index_path):
+        # drop the unused tail of the buffer
+        self.matrix = self.matrix[:self.size].copy()
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    ##### embedding #####
+
+    def _numeric(self, df):
+        X = df.reindex(columns=self.numeric_cols).apply(pd.to_numeric, errors='coerce')
+        X = X.fillna(0.)
+        for col in log_cols:
+            if col in X:
+                X[col] = np.log1p(X[col].clip(lower=0))
+        return X.values
+
+    def _text(self, df):
+        return df.get('chan_desc', pd.Series('', index=df.index)).fillna('').astype(str)
+
+    def _embed(self, df, fit=False):
+        numeric = self._numeric(df)
+        text = self._text(df)
+        if fit:
+            numeric = self.scaler.fit_transform(numeric)
+            tfidf = self.vectorizer.fit_transform(text)
+            # the text model can't have more components than there are documents / terms
+            self.svd.n_components = max(1, min(self.text_dims, tfidf.shape[0] - 1,
+                                               len(self.vectorizer.vocabulary_) - 1))
+            text = self.svd.fit_transform(tfidf)
+        else:
+            numeric = self.scaler.transform(numeric)
+            text = self.svd.transform(self.vectorizer.transform(text))
+
+        numeric /= np.sqrt(numeric.shape[1])
+        text = text / np.maximum(np.linalg.norm(text, axis=1, keepdims=True), 1e-12)
+        vectors = np.hstack([numeric, self.text_weight * text]).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    ##### building #####
+
+    def fit(self, df):
+        '''
+        Fit the scaler and text model on a catalog dataframe and index it.
+        '''
+
+        vectors = self._embed(df, fit=True)
+
+        self.matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self.size = 0
+        self.chans, self.titles, self.urls, self.rows = [], [], [], {}
+        self._insert(df, vectors)
+        return self
+
+    def add(self, df):
+        '''
+
+        Insert newly scraped channels, using the already fitted models.
+        A channel that is already indexed has its vector replaced.
+
+        '''
+
+        self._insert(df, self._embed(df))
+        return self
+
+    def _insert(self, df, vectors):
+        for (title, chan_url), vector in zip(df[['title', 'chan_url']].itertuples(index=False), vectors):
+            chan = channel_index.chan_id(chan_url)
+            if chan in self.rows:
+                self.matrix[self.rows[chan]] = vector
+                continue
+
+            if self.size == len(self.matrix):
+                grown = np.zeros((max(16, 2 * len(self.matrix)), vectors.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.matrix[:self.size]
+                self.matrix = grown
+
+            self.matrix[self.size] = vector
+            self.rows[chan] = self.size
+            self.chans += [chan]
+            self.titles += [title]
+            self.urls += [chan_url]
+            self.size += 1
+
+    ##### querying #####
+
+    def _row(self, channel):
+        '''
+        Row of a channel given its title, URL or channel id.
+        '''
+
+        key = channel_index.chan_id(channel)
+        if key in self.rows:
+            return self.rows[key]
+        if channel in self.titles:
+            return self.titles.index(channel)
+        raise KeyError(channel)
+
+    def query(self, vector, k=10, exclude=None):
+        '''
+
+        Top-k most similar rows to a query vector,
+        as a list of (row, cosine similarity), best first.
+
+        '''
+
+        scores = self.matrix[:self.size] @ vector
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, self.size - (exclude is not None))
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def most_similar(self, channel, k=10):
+        '''
+
+        The k channels most like `channel` (a title, URL or channel id),
+        as a dataframe of title, chan_url and similarity.
+
+        '''
+
+        row = self._row(channel)
+        hits = self.query(self.matrix[row], k=k, exclude=row)
+        return pd.DataFrame({'title': [self.titles[i] for i, _ in hits],
+                             'chan_url': [self.urls[i] for i, _ in hits],
+                             'similarity': [s for _, s in hits]})
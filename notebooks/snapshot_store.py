@@ -0,0 +1,236 @@
+# Time-series store for channel counts (sub_count, play_count, twitter followers...).
+# Every scrape appends an observation instead of saving another full dated copy.
+#
+# Each (channel, metric) series is kept as a first (time, value) pair
+# followed by delta-encoded numpy arrays. Every observation is kept;
+# an unchanged count is a zero delta, which costs a byte.
+
+import hashlib
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import channel_index
+
+
+snapshot_path = '../social_metrics/snapshots.pickle'
+
+
+def to_epoch(when):
+    '''
+    Seconds since the epoch for a datetime, date string or number.
+    '''
+
+    if isinstance(when, (int, float, np.integer, np.floating)):
+        return int(when)
+    return int(pd.Timestamp(when).timestamp())
+
+
+def _smallest_int(deltas):
+    '''
+    Downcast an int64 delta array to the smallest dtype that holds it.
+    '''
+
+    if len(deltas) == 0:
+        return deltas.astype(np.int32)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if deltas.min() >= info.min and deltas.max() <= info.max:
+            return deltas.astype(dtype)
+    return deltas
+
+
+class SnapshotStore:
+    '''
+
+    Append-only store of channel metric observations.
+
+    Usage:
+
+    store = SnapshotStore.load()
+    store.ingest_twitter_stats('../social_metrics/twitter/channel_stats_by_name_oct8_2p.pickle',
+                               observed_at='2019-10-08 14:00')
+    store.as_of('id431951', 'twitter_followers', '2019-10-07')
+    store.growth('id431951', 'play_count', '2019-10-01', '2019-10-08', per_day=True)
+    store.save()
+
+    '''
+
+    def __init__(self):
+        # (chan, metric) -> (t0, v0, time deltas, value deltas)
+        self.series = {}
+        # (chan, metric) -> list of (time, value) not yet encoded
+        self.pending = {}
+        # hashes of every snapshot ingested, so identical copies are skipped
+        self.seen = set()
+
+    @classmethod
+    def load(cls, path=snapshot_path):
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path=snapshot_path):
+        self.flush()
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    ##### writing #####
+
+    def append(self, chan, metric, when, value):
+        '''
+        Record one observation. Nothing is encoded until the series is read or saved.
+        '''
+
+        self.pending.setdefault((chan, metric), []).append((to_epoch(when), int(value)))
+
+    def flush(self):
+        for key in list(self.pending):
+            self._encode(key)
+
+    def _encode(self, key):
+        times, values = self._decode(key)
+        new = self.pending.pop(key, [])
+        if new:
+            new_t, new_v = zip(*new)
+            times = np.concatenate([times, np.array(new_t, dtype=np.int64)])
+            values = np.concatenate([values, np.array(new_v, dtype=np.int64)])
+
+        # sort by time; the last observation at a given time wins
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+        keep = np.append(times[1:] != times[:-1], True)
+        times, values = times[keep], values[keep]
+
+        if len(times) == 0:
+            return
+        self.series[key] = (int(times[0]), int(values[0]),
+                            _smallest_int(np.diff(times)), _smallest_int(np.diff(values)))
+
+    def _decode(self, key):
+        if key not in self.series:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        t0, v0, dt, dv = self.series[key]
+        times = np.concatenate([[t0], t0 + np.cumsum(dt, dtype=np.int64)])
+        values = np.concatenate([[v0], v0 + np.cumsum(dv, dtype=np.int64)])
+        return times, values
+
+    def _read(self, key):
+        if key in self.pending:
+            self._encode(key)
+        return self._decode(key)
+
+    def observe(self, features, observed_at=None):
+        '''
+        Record sub_count and play_count from one freshly scraped channel.
+        '''
+
+        observed_at = observed_at if observed_at is not None else pd.Timestamp.now()
+        chan = channel_index.chan_id(features['chan_url'])
+        for metric in ('sub_count', 'play_count'):
+            if metric in features:
+                self.append(chan, metric, observed_at, features[metric])
+
+    def ingest(self, snapshot, metrics, observed_at, key_func=None):
+        '''
+
+        Append every metric of a {name: record} snapshot dictionary,
+        all observed at `observed_at`.
+
+        Records are keyed by channel id (from 'chan_url'), falling back on the name.
+        Return False, and change nothing, if this exact snapshot was ingested before.
+
+        '''
+
+        digest = hashlib.sha1(repr(sorted(snapshot.items(), key=lambda kv: str(kv[0]))).encode()).hexdigest()
+        if digest in self.seen:
+            return False
+        self.seen.add(digest)
+
+        for name, record in snapshot.items():
+            if key_func is not None:
+                chan = key_func(name, record)
+            elif 'chan_url' in record:
+                chan = channel_index.chan_id(record['chan_url'])
+            else:
+                chan = name
+            for metric, field in metrics.items():
+                try:
+                    self.append(chan, metric, observed_at, record[field])
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+        return True
+
+    def ingest_twitter_stats(self, path, observed_at):
+        '''
+        Load one of the dated channel_stats_by_name pickles.
+        '''
+
+        with open(path, 'rb') as file:
+            twitter_dict = pickle.load(file)
+        return self.ingest(twitter_dict, {'twitter_followers': 'follower_count'}, observed_at)
+
+    def ingest_channels(self, df, observed_at):
+        '''
+        Record sub_count and play_count for every channel in a scraped dataframe.
+        '''
+
+        snapshot = {row.chan_url: {'chan_url': row.chan_url,
+                                   'sub_count': row.sub_count,
+                                   'play_count': row.play_count}
+                    for row in df[['chan_url', 'sub_count', 'play_count']].itertuples()}
+        return self.ingest(snapshot, {'sub_count': 'sub_count', 'play_count': 'play_count'}, observed_at)
+
+    ##### reading #####
+
+    def history(self, chan, metric):
+        '''
+        The full series as a pandas Series indexed by timestamp.
+        '''
+
+        times, values = self._read((chan, metric))
+        return pd.Series(values, index=pd.to_datetime(times, unit='s'), name=metric)
+
+    def as_of(self, chan, metric, when):
+        '''
+        Latest value observed at or before `when`, or None.
+        '''
+
+        times, values = self._read((chan, metric))
+        i = np.searchsorted(times, to_epoch(when), side='right') - 1
+        if i < 0:
+            return None
+        return int(values[i])
+
+    def growth(self, chan, metric, start, end, per_day=False):
+        '''
+
+        Change in a metric between `start` and `end` (as-of values at each end).
+        With per_day=True, divide by the length of the window in days.
+        None if the channel hadn't been observed by `start`.
+
+        '''
+
+        first = self.as_of(chan, metric, start)
+        last = self.as_of(chan, metric, end)
+        if first is None or last is None:
+            return None
+        delta = last - first
+        if per_day:
+            days = (to_epoch(end) - to_epoch(start)) / (24. * 60. * 60.)
+            return delta / days if days else 0.
+        return delta
+
+    def growth_frame(self, metric, start, end, per_day=False):
+        '''
+        growth() for every channel with that metric, as a Series indexed by channel.
+        '''
+
+        self.flush()
+        chans = [chan for chan, m in self.series if m == metric]
+        return pd.Series({chan: self.growth(chan, metric, start, end, per_day) for chan in chans},
+                         name=metric + '_growth', dtype=float)
@@ -2,6 +2,7 @@ from bs4 import BeautifulSoup
 import requests
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 import sys
@@ -14,9 +15,20 @@ import importlib
 
 import re
 
+import channel_directory
+import channel_index
+import profiling
+import crawl_scheduler
+import retry_policy
+import snapshot_store
+
 # webdriver imports
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 chromedriver = "/Applications/chromedriver" # path to the chromedriver executable
 os.environ["webdriver.chrome.driver"] = chromedriver
 
@@ -105,6 +117,7 @@ def get_category_source(url, dr):
 
     # Navigate to the webpage
     # dr.set_window_rect(*window_rect)
+    profiling.instrument_driver(dr)
     dr.get(url)
 
     # close annoying cookie verification
@@ -142,7 +155,155 @@ def collect_category_pods(soup):
     return cat_dict
 
 
-def scrape_full_category_page(url, dr):
+# Pull the coverRows past a given offset straight out of the DOM,
+# so the page source never has to be serialized and reparsed.
+new_cover_rows_js = '''
+var rows = document.querySelectorAll('div.coverRow');
+var out = [];
+for (var i = arguments[0]; i < rows.length; i++) {
+    var a = rows[i].querySelector('a');
+    var title = rows[i].querySelector('.title');
+    var author = rows[i].querySelector('.author');
+    out.push([a ? a.getAttribute('href') : null,
+              title ? title.textContent : null,
+              author ? author.textContent : null]);
+}
+return out;
+'''
+
+category_name_js = '''
+var el = document.querySelector('.guru-breadcrumb-item.active');
+return el ? el.textContent : null;
+'''
+
+
+def stream_category_pods(url, dr):
+    '''
+
+    Incremental version of get_category_source + collect_category_pods.
+
+    Scrolls the category page like scroll_bottom, but after every scroll step
+    only the coverRows that appeared since the last step are read from the DOM.
+    Yields (title, {'chan_url', 'author'}) pairs as soon as they load.
+
+    '''
+
+    def new_rows():
+        nonlocal offset
+        rows = dr.execute_script(new_cover_rows_js, offset)
+        offset += len(rows)
+        for href, title, author in rows:
+            if href is None or title is None:
+                continue
+            yield title, {'chan_url': index_dir + href, 'author': author}
+
+    profiling.instrument_driver(dr)
+    dr.get(url)
+
+    # close annoying cookie verification
+    try:
+        dr.find_element_by_class_name('allow').click()
+    except:
+        # sometimes the cookie doesn't appear
+        pass
+
+    SCROLL_PAUSE_TIME = 2
+    offset = 0
+    last_height = dr.execute_script("return document.body.scrollHeight")
+    while True:
+        yield from new_rows()
+
+        # down, back up, then down again to trigger infinite scroll
+        dr.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        time.sleep(1)
+        dr.execute_script("window.scrollTo(0, 0);")
+        time.sleep(1)
+        dr.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        time.sleep(SCROLL_PAUSE_TIME)
+
+        new_height = dr.execute_script("return document.body.scrollHeight")
+        if new_height == last_height:
+            yield from new_rows()
+            return
+        last_height = new_height
+
+
+def scrape_category_into_queue(url, dr, crawl_queue=None):
+    '''
+
+    Stream a category page, putting each channel on `crawl_queue`
+    (a queue.Queue) as (category_name, title, {'chan_url', 'author'})
+    the moment it shows up, so channel workers can start while the
+    category is still loading.
+
+    Return the category name and the full category listing, like
+    scrape_full_category_page.
+
+    '''
+
+    category_name = None
+    category_dict = {}
+    for title, info in stream_category_pods(url, dr):
+        if category_name is None:
+            category_name = dr.execute_script(category_name_js)
+        category_dict[title] = info
+        if crawl_queue is not None:
+            crawl_queue.put((category_name, title, info))
+
+    if category_name is None:
+        category_name = dr.execute_script(category_name_js)
+
+    return category_name, category_dict
+
+
+def crawl_channels_from_queue(crawl_queue, dr):
+    '''
+
+    Channel worker for scrape_category_into_queue.
+
+    Scrapes and exports every channel taken off `crawl_queue`,
+    skipping channels already scraped under any category,
+    until it takes a None off the queue.
+
+    Run it in its own thread, with its own web driver.
+
+    '''
+
+    scraped_index = channel_index.load_scraped_index()
+
+    while True:
+        item = crawl_queue.get()
+        if item is None:
+            break
+        category, chan, info = item
+        chan_url = info['chan_url']
+
+        if category is None:
+            # the breadcrumb hadn't rendered; there's no category file to export to
+            print(f'{chan}: no category name for {chan_url}, skipping')
+            continue
+
+        scraped_cats = scraped_index.get(channel_index.chan_id(chan_url))
+        if scraped_cats:
+            if category not in scraped_cats:
+                channel_index.record_scraped(scraped_index, chan, chan_url, category)
+            continue
+
+        try:
+            features = scrape_channel_page(chan_url, dr)
+        except Exception as e:
+            print(f'{chan} scrape error: {e}')
+            continue
+
+        if len(features.get('recent_eps', [])) == 0:
+            print(f'{chan} invalidly scraped. not exporting.')
+            continue
+
+        export_channel_features(features, category)
+        channel_index.record_scraped(scraped_index, chan, chan_url, category)
+
+
+def scrape_full_category_page(url, dr, stream=False, directory=None, crawl_queue=None):
     '''
 
     Crawl through the entirety of a category page.
@@ -150,190 +311,234 @@ def scrape_full_category_page(url, dr):
     Takes the URL of the category page,
     and the web driver.
 
+    With stream=True, rows are read incrementally as the page scrolls
+    (see stream_category_pods) instead of parsing the full page source,
+    and each channel is put on `crawl_queue`, if given, as soon as it is
+    found (see scrape_category_into_queue).
+
+    If `directory` (an open channel_directory connection) is given,
+    the listing is upserted into it.
+
     Return the scraped category listing,
     as well as the name of the category.
 
     '''
 
 
-    # open page properly and get full source
-    source = get_category_source(url, dr)
-    time.sleep(0.2)
+    if stream:
+        category_name, category_dict = scrape_category_into_queue(url, dr, crawl_queue)
+
+    else:
+        # open page properly and get full source
+        source = get_category_source(url, dr)
+        time.sleep(0.2)
 
-    # grab entire listing as dictionary
-    soup = BeautifulSoup(source, 'lxml')
-    category_dict = collect_category_pods(soup)
+        # grab entire listing as dictionary
+        soup = BeautifulSoup(source, 'lxml')
+        category_dict = collect_category_pods(soup)
 
-    # page category
-    category_name = soup.find(class_='guru-breadcrumb-item active').text
+        # page category
+        category_name = soup.find(class_='guru-breadcrumb-item active').text
+
+    if directory is not None:
+        channel_directory.upsert_category(directory, category_name, category_dict)
 
     return category_name, category_dict
 
 
-def process_channel_soup(chan_url, html, dr):
+def fetch_channel_html(chan_url, dr, log=None, settle=10):
     '''
 
-    Build features from scraped html of url.
-    Use on a single channel's page.
+    Load a channel page in the browser and return its source.
 
-    Return a dictionary of features for that channel.
+    Waits up to `settle` seconds for the episode list to render,
+    so the source isn't read before the page has filled in.
 
     '''
-    
-    scrape_attempts = 0
-    debug = False
-    while scrape_attempts < 5:
-        
-        scrape_attempts += 1
-        # some scrapes are failing. Introduce multiple attempts.
-        
-        if debug:
-            dr.get(chan_url + '?country=us')
-            time.sleep(3)
 
-            try:
-                # try to close annoying cookie verification
-                cookie = dr.find_element_by_class_name('allow')
-                cookie.click()
-                log.write(str(dt.datetime.now()) + ' - closed popup')
-            except:
-                # unless it's not there
-                pass
+    profiling.instrument_driver(dr)
+    dr.get(chan_url + '?country=us')
 
-            html = dr.page_source
-    #         print('html:\n', html)
-    #         print(html[-100:])
-            assert len(html) != 0
-        
-        try:
-            print('trying to scrape ', chan_url, ' attempt #', scrape_attempts)
-            f = {}
+    try:
+        # try to close annoying cookie verification
+        cookie = dr.find_element_by_class_name('allow')
+        cookie.click()
+        if log:
+            log.write(str(dt.datetime.now()) + ' - closed popup')
+    except:
+        # unless it's not there
+        pass
 
-            soup = BeautifulSoup(html, 'lxml')
+    try:
+        WebDriverWait(dr, settle).until(
+            expected_conditions.presence_of_element_located((By.CLASS_NAME, 'ep-item')))
+    except TimeoutException:
+        # parse whatever is there; the retry policy decides what to do with it
+        pass
 
-            ##### Individual Channel Features #####
+    html = dr.page_source
+    if len(html) == 0:
+        raise retry_policy.ScrapeFailure(retry_policy.DRIVER_ERROR, 'empty page source')
 
-            # channel title for validation
-            f['title'] = soup.find(class_='ch_feed_info_title').find('span').text
+    return html
 
-            f['chan_url'] = chan_url
 
-#             print('scraping....... ', f['title'])
+def parse_channel_soup(chan_url, html):
+    '''
 
-            comment_el = re.sub('[\(\)]', '', soup.find(class_='commentList-title').find('span').text.split('\xa0')[-1])
+    Parse the features out of a single channel page's html.
 
-            if len(comment_el) == 0:
-                num_comments = 0
-            else:
-                num_comments = int(comment_el)
-        #     print(num_comments)
-            
-#             if debug:
-#                 print('checkpoint A')
-            
-            f['num_comments'] = int(num_comments)
+    Raise retry_policy.ScrapeFailure (or whatever BeautifulSoup trips on)
+    if the page is incomplete.
 
-            # channel author
-            f['author'] = soup.find(class_='author').text.split(':')[-1].strip().replace(',','')
+    '''
 
-            # if the channel has the isExplicit class (I believe this global label
-            # is applied if any of podcasts are marked as 'E')
-            f['isExplicit'] = int(bool(soup.find_all('h1', {'class': 'isExplicit'})))
+    f = {}
 
-            # subscriber count
-            f['sub_count'] = int(soup.find(class_='sub_count').text.split(':')[-1].strip().replace(',',''))
-            
-#             if debug:
-#                 print('checkpoint B')
+    soup = BeautifulSoup(html, 'lxml')
 
-            # total channel plays for all episodes
-            f['play_count'] = int(soup.find(class_='play_count').text.split(':')[-1].strip().replace(',',''))
+    ##### Individual Channel Features #####
 
-            # all listed social feeds, including channel website
-            f['ch_feed-socials'] = [a.get('href') for a in soup.find(class_='ch_feed-socials').find_all('a')]
-            
-#             if debug:
-#                 print('checkpoint B-2')
-        #     print('episode total div: \n', soup.find(class_='trackListCon_title').text.split('\xa0')[0])
+    # channel title for validation
+    f['title'] = soup.find(class_='ch_feed_info_title').find('span').text
 
-            # episode count
-            f['ep_total'] = soup.find(class_='trackListCon_title').text.split('\xa0')[0]
-#             print(f['ep_total'])
-            
-#             if debug:
-#                 print('checkpoint C')
-#                 
-            try:
-                f['ep_total'] = int(f['ep_total'])
-            except:
-                # failed to grab episodes, for whatever reason
-                print('Episode total scraped as non-integer... rescraping ', f['title'])
-                print(f['ep_total'])
-                debug = True
-            
-                continue
+    f['chan_url'] = chan_url
 
-            # grab all (visible) episode rows
-            visible_eps = soup.find_all(class_='ep-item')
-            recent_eps = []
-            
-#             if debug:
-#                 print('checkpoint D')
-                
-#             print(visible_eps)
-            # iterate through all visible episodes and grab basic info
-            for ep in visible_eps:
-                ep_name = ep.find('span', class_='ellipsis').text
-                ep_date = ep.find('span', class_='date').text
-                ep_len = ep.find('span', class_='time').text
-                favs = ep.find_all(class_='heart')
-        #         print(favs[0].parent)
-                if len(favs) > 0:
-                    ep_favs = int(favs[0].parent.text)
-                else:
-                    ep_favs = 0
-#                 print(ep_date, ep_len, ep_favs)
-                recent_eps += [[ep_date, ep_len, ep_favs]]
-
-#             print(recent_eps)
-            f['recent_eps'] = recent_eps
-            
-            if len(f['recent_eps']) == 0:
-                # failed to grab episodes, for whatever reason
-                print('Didn\'t properly grab recent episodes... rescraping', f['title'])
-                debug = True
+    comment_el = re.sub('[\(\)]', '', soup.find(class_='commentList-title').find('span').text.split('\xa0')[-1])
+
+    if len(comment_el) == 0:
+        num_comments = 0
+    else:
+        num_comments = int(comment_el)
+
+    f['num_comments'] = int(num_comments)
+
+    # channel author
+    f['author'] = soup.find(class_='author').text.split(':')[-1].strip().replace(',','')
+
+    # if the channel has the isExplicit class (I believe this global label
+    # is applied if any of podcasts are marked as 'E')
+    f['isExplicit'] = int(bool(soup.find_all('h1', {'class': 'isExplicit'})))
+
+    # subscriber count
+    f['sub_count'] = int(soup.find(class_='sub_count').text.split(':')[-1].strip().replace(',',''))
+
+    # total channel plays for all episodes
+    f['play_count'] = int(soup.find(class_='play_count').text.split(':')[-1].strip().replace(',',''))
+
+    # all listed social feeds, including channel website
+    f['ch_feed-socials'] = [a.get('href') for a in soup.find(class_='ch_feed-socials').find_all('a')]
+
+    # episode count
+    ep_total = soup.find(class_='trackListCon_title').text.split('\xa0')[0]
+    try:
+        f['ep_total'] = int(ep_total)
+    except ValueError:
+        # failed to grab episodes, for whatever reason
+        raise retry_policy.ScrapeFailure(retry_policy.BAD_EP_TOTAL,
+                                         f'episode total scraped as {ep_total!r}')
+
+    # grab all (visible) episode rows
+    visible_eps = soup.find_all(class_='ep-item')
+    recent_eps = []
+
+    # iterate through all visible episodes and grab basic info
+    for ep in visible_eps:
+        ep_name = ep.find('span', class_='ellipsis').text
+        ep_date = ep.find('span', class_='date').text
+        ep_len = ep.find('span', class_='time').text
+        favs = ep.find_all(class_='heart')
+        if len(favs) > 0:
+            ep_favs = int(favs[0].parent.text)
+        else:
+            ep_favs = 0
+        recent_eps += [[ep_date, ep_len, ep_favs]]
+
+    f['recent_eps'] = recent_eps
+
+    if len(f['recent_eps']) == 0:
+        # failed to grab episodes, for whatever reason
+        raise retry_policy.ScrapeFailure(retry_policy.NO_RECENT_EPS,
+                                         'didn\'t properly grab recent episodes')
+
+    #### TEXT BASED FEATURES ####
+
+    # grab all of the hover text for all episodes: ep-item-desmodal-con
+    f['hover_text_concat'] = ' | '.join([s.text for s in soup.find_all(class_='ep-item-desmodal-con')])
+
+    # channel description
+    f['chan_desc'] = soup.find(class_='des-con').text
+
+    f['cover_img_url'] = soup.find(class_='coverImgContainer').find('img').get('src')
+
+    return f
+
+
+def process_channel_soup(chan_url, html=None, dr=None, max_attempts=5, log=None):
+    '''
+
+    Build features from scraped html of url.
+    Use on a single channel's page.
+
+    If `html` is None, the page is loaded with `dr` as the first attempt.
+    Failures are classified by retry_policy. Page loads and parses count alike:
+    only failures a fresh page load could fix are retried, with jittered
+    exponential backoff in between, and a retry that returns the exact same
+    html is not parsed again.
+    Repeated page load failures (driver errors, empty pages) trip the per-host
+    circuit breaker, which pauses the crawl; parse failures don't.
+
+    Return a dictionary of features for that channel,
+    or an empty dictionary if every attempt failed.
+
+    '''
+
+    breaker = retry_policy.get_breaker(chan_url)
+
+    for attempt in range(1, max_attempts + 1):
+
+        if attempt > 1:
+            time.sleep(retry_policy.backoff_delay(attempt - 1))
+
+        if attempt > 1 or html is None:
+            breaker.wait()
+
+            try:
+                fresh_html = fetch_channel_html(chan_url, dr, log)
+            except Exception as e:
+                kind = retry_policy.classify_failure(e)
+                if retry_policy.is_throttling(kind):
+                    breaker.record_failure()
+                print(f'Failed to load {chan_url} ({kind}): {e}')
+                if not retry_policy.should_refetch(kind):
+                    break
                 continue
-            
-#             if debug:
-#                 print('checkpoint E')
-                
-            #### TEXT BASED FEATURES ####
 
-            # grab all of the hover text for all episodes: ep-item-desmodal-con
-            f['hover_text_concat'] = ' | '.join([s.text for s in soup.find_all(class_='ep-item-desmodal-con')])
+            # the host answered; whatever goes wrong from here is this channel's problem
+            breaker.record_success()
 
-            # channel description
-            f['chan_desc'] = soup.find(class_='des-con').text
+            if fresh_html == html:
+                # nothing new to parse; the page isn't going to change
+                print(f'Reloaded page for {chan_url} is unchanged, giving up')
+                break
+            html = fresh_html
 
-            f['cover_img_url'] = soup.find(class_='coverImgContainer').find('img').get('src')
-            
-#             if debug:
-#                 print('checkpoint F')
-            
-            print('COMPLETED scraping ',f['title'])
-            break
-            
-        except:
-            print('Failed scrape for ', f['title'], ' rescraping...')
-            debug = True
-            time.sleep(1)
-            
+        try:
+            print('trying to scrape ', chan_url, ' attempt #', attempt)
+            f = parse_channel_soup(chan_url, html)
+        except Exception as e:
+            # parse failures stay with this channel; they don't pause the crawl
+            kind = retry_policy.classify_failure(e)
+            print(f'Failed scrape for {chan_url} ({kind}): {e}')
+            if not retry_policy.should_refetch(kind):
+                break
             continue
-            
-        
-    # end while
 
-    return f
+        breaker.record_success()
+        print('COMPLETED scraping ', f['title'])
+        return f
+
+    return {}
 
 
 def scrape_channel_page(chan_url, dr):
@@ -352,24 +557,12 @@ def scrape_channel_page(chan_url, dr):
 
         # driver = webdriver.Chrome(chromedriver)
 
-        dr.get(chan_url + '?country=us')
-
-        try:
-            # try to close annoying cookie verification
-            cookie = dr.find_element_by_class_name('allow')
-            cookie.click()
-            log.write(str(dt.datetime.now()) + ' - closed popup')
-        except:
-            # unless it's not there
-            pass
-
-        html = dr.page_source
-#         print('html:\n', html)
-#         print(html[-100:])
-        assert len(html) != 0
-
-        features = process_channel_soup(chan_url, html, dr)
+        features = process_channel_soup(chan_url, dr=dr, log=log)
         log.write(str(dt.datetime.now()) + ' - processed features on page')
+
+        if len(features) == 0:
+            log.write(' - failed, skipping first release date' + '\n')
+            return features
         
         time.sleep(5)
         reverse_btn = dr.find_element_by_class_name('funcBtn-item')
@@ -393,13 +586,143 @@ def scrape_channel_page(chan_url, dr):
         
         return features
 
+
+def check_channel_url(chan_url, timeout=5):
+    '''
+
+    Cheap liveness check of a channel URL, without launching the browser.
+
+    Sends a HEAD request (falling back on a streamed GET when the server
+    won't answer HEAD) and does not follow redirects blindly.
+
+    Return a (status, url) tuple, where status is one of:
+        'live'      - page answered 2xx; url is the (possibly moved) channel URL
+        'redirect'  - page redirects away from the channel, e.g. to the homepage
+        'not_found' - 404 / 410
+        'timeout'   - no answer within `timeout` seconds
+        'error'     - anything else (5xx, connection refused...)
+
+    '''
+
+    url = chan_url
+    for hop in range(5):
+        try:
+            resp = requests.head(url, params={'country': 'us'},
+                                 allow_redirects=False, timeout=timeout)
+            if resp.status_code in (403, 405, 501):
+                # some servers refuse HEAD; only read the headers of a GET
+                resp = requests.get(url, params={'country': 'us'},
+                                    allow_redirects=False, timeout=timeout, stream=True)
+                resp.close()
+        except requests.exceptions.Timeout:
+            return 'timeout', url
+        except requests.exceptions.RequestException:
+            return 'error', url
+
+        if resp.status_code in (301, 302, 303, 307, 308):
+            location = requests.compat.urljoin(url, resp.headers.get('Location', ''))
+            # a moved channel keeps its id; anything else is a dead listing
+            if channel_index.chan_id(location) != channel_index.chan_id(chan_url):
+                return 'redirect', location
+            url = location.split('?')[0]
+            continue
+
+        if 200 <= resp.status_code < 300:
+            return 'live', url
+        if resp.status_code in (404, 410):
+            return 'not_found', url
+        return 'error', url
+
+    return 'redirect', url
+
+
+def prevalidate_channel_urls(chan_dict, max_workers=16, timeout=5,
+                             dead_path='../scraped/channel/dead/dead_links.csv'):
+    '''
+
+    Filter dead channel URLs out of a channel dict before the browser sees them.
+
+    Takes the usual {category: {title: {'chan_url', 'author'}}} dict,
+    checks every unique channel concurrently with `check_channel_url`,
+    and appends dead channels to `dead_path` as
+    'chan_title,chan_url,category,status'.
+
+    Return a channel dict of the same shape holding only live channels
+    (with moved URLs corrected), and the list of dead records.
+
+    '''
+
+    # the same channel is listed in several categories; check it once
+    urls = {}
+    for category in chan_dict:
+        for chan in chan_dict[category]:
+            chan_url = chan_dict[category][chan]['chan_url']
+            urls.setdefault(channel_index.chan_id(chan_url), chan_url)
+
+    print(f'prevalidating {len(urls)} channel urls...')
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {key: pool.submit(check_channel_url, url, timeout) for key, url in urls.items()}
+        results = {key: future.result() for key, future in futures.items()}
+
+    live_dict = {}
+    dead = []
+    for category in chan_dict:
+        live_dict[category] = {}
+        for chan, info in chan_dict[category].items():
+            status, url = results[channel_index.chan_id(info['chan_url'])]
+            if status == 'live':
+                live_dict[category][chan] = dict(info, chan_url=url)
+            else:
+                dead += [[chan, info['chan_url'], category, status]]
+
+    if dead and dead_path:
+        # (channel id, status) pairs already on file, so reruns don't repeat them
+        logged = set()
+        try:
+            with open(dead_path, 'r') as file:
+                for line in file:
+                    parts = line.strip().rsplit(',', 3)
+                    if len(parts) == 4:
+                        logged.add((channel_index.chan_id(parts[1]), parts[3]))
+        except FileNotFoundError:
+            pass
+
+        with open(dead_path, 'a') as file:
+            for record in dead:
+                key = (channel_index.chan_id(record[1]), record[3])
+                if key in logged:
+                    continue
+                logged.add(key)
+                file.write(','.join(str(r) for r in record) + '\n')
+
+    print(f'{len(dead)} dead channel listings, '
+          f'{sum(len(v) for v in live_dict.values())} live')
+
+    return live_dict, dead
+
+def export_channel_features(features, category):
+    '''
+    
+    Append a channel's feature dictionary to its category's .txt file,
+    as a single {title: features} line.
+    
+    '''
+    
+    export_path = '../scraped/channel/by_category/' + category + '.txt'
+    with open(export_path, 'a') as file:
+        feat_dict = {features['title']: features}
+        file.write(str(feat_dict) + '\n\n')
+
 #####
 
-def scrape_all_pods_in_category(chan_dict, category, dr, export=False):
+def scrape_all_pods_in_category(chan_dict, category, dr, export=False, prevalidate=False):
     '''
     
     Given a category name, scrape all podcasts in that category.
     
+    With prevalidate=True, dead channel URLs are filtered out with cheap
+    HTTP checks first, so they never cost a full browser page load.
+    
     '''
     
 #     print(f'Scraping {category} category...')
@@ -407,8 +730,6 @@ def scrape_all_pods_in_category(chan_dict, category, dr, export=False):
     window_rect=(0, 0, 800, 1200)
     dr.set_window_rect(*window_rect)
     
-    category_list = list(chan_dict[category].keys())
-    
     # get a list of already scraped channels, to avoid repetition:
 #     with open('../scraped/channel/already_scraped.csv', 'r') as file:
 #         scraped = pd.read_csv(file, names=['chan_title','chan_url','category'])
@@ -416,17 +737,31 @@ def scrape_all_pods_in_category(chan_dict, category, dr, export=False):
 #         print('scraped so far:')
 #         print(' | '.join(list(scraped.chan_title)))
         
-    scraped_urls = []
-    with open('../scraped/channel/already_scraped.csv', 'r') as file:
-        for line in file:
-    #         print(line)
-            chan_url = line.split(',')[-2]
-#             print(chan_url)
-            scraped_urls += [chan_url]
+    # channel id -> set of categories it has been scraped or listed under.
+    # The same podcast shows up in several categories; only fetch it once.
+    scraped_index = channel_index.load_scraped_index()
     
-    for chan in category_list:
+    # read the listing once; a DirectoryView runs a query on every lookup
+    listing = chan_dict[category]
+    
+    if prevalidate:
+        # only channels we'd actually load are worth an HTTP check
+        unscraped = {chan: info for chan, info in listing.items()
+                     if channel_index.chan_id(info['chan_url']) not in scraped_index}
+        live_dict, _ = prevalidate_channel_urls({category: unscraped})
+        listing = {chan: live_dict[category].get(chan, info)
+                   for chan, info in listing.items()
+                   if chan not in unscraped or chan in live_dict[category]}
+    
+    category_list = list(listing.keys())
+    
+    # every exported scrape is also an observation of its counts
+    store = snapshot_store.SnapshotStore.load()
+    
+    try:
+        for chan in category_list:
 #       
-        fail = False
+            fail = False
         
 #         print(chan)
 #         print(type(chan))
@@ -435,56 +770,98 @@ def scrape_all_pods_in_category(chan_dict, category, dr, export=False):
 # #             print('[ skipping: ', chan, ' ] ')
 #             continue
         
-        chan_url = chan_dict[category][chan]['chan_url']
-        
-        if chan_url in scraped_urls:
-            continue
+            chan_url = listing[chan]['chan_url']
         
-        try:
-            features = scrape_channel_page(chan_url, dr)
-        except:
-            'channel scrape error, not exporting'
-            pass
+            scraped_cats = scraped_index.get(channel_index.chan_id(chan_url))
+            if scraped_cats:
+                # already fetched under another category; just record membership
+                if category not in scraped_cats:
+                    channel_index.record_scraped(scraped_index, chan, chan_url, category)
+                continue
         
-#         print(features['recent_eps'], ' has len ', len(features['recent_eps']))
+            try:
+                features = scrape_channel_page(chan_url, dr)
+            except Exception as e:
+                # channel scrape error, not exporting
+                print(f'{chan} scrape error: {e}')
+                features = {}
         
-        # various validations that channel was correctly scraped:
-        if len(features) == 0:
-            print(f'{chan_title} invalidly scraped. not exporting.')
-            fail = True
-        if len(features['recent_eps']) == 0:
-            print(f'{chan_title} invalidly scraped. not exporting.')
-            fail = True
+            # various validations that channel was correctly scraped:
+            if len(features) == 0:
+                print(f'{chan} invalidly scraped. not exporting.')
+                fail = True
+            elif len(features.get('recent_eps', [])) == 0:
+                print(f'{chan} invalidly scraped. not exporting.')
+                fail = True
         
-        try:
-            chan_title = features['title']
-        except:
-            print('key error: ', chan)
-            continue
+            try:
+                chan_title = features['title']
+            except:
+                print('key error: ', chan)
+                continue
             
-        # add feature dictionary as single line in .txt
-        if (export==True) or (fail == True):
-            export_path = '../scraped/channel/by_category/' + category + '.txt'
-            with open(export_path, 'a') as file:
-                feat_dict = {chan_title: features}
-                file.write(str(feat_dict) + '\n\n')
-                file.close()
+            # add feature dictionary as single line in .txt
+            if (export==True) or (fail == True):
+                export_channel_features(features, category)
+                if not fail:
+                    store.observe(features)
                   
-            # log when channel has been scraped
-            export_path = '../scraped/channel/already_scraped.csv'
-            with open(export_path, 'a') as file:
-                scraped_chan = str(chan) + ',' + str(chan_url) + ',' + str(category)
-                file.write(scraped_chan + '\n')
-                file.close()
-        else:
-            print('DEBUG: features dictionary for ', chan_title)
-            print(features)
+                # log when channel has been scraped
+                channel_index.record_scraped(scraped_index, chan, chan_url, category)
+            else:
+                print('DEBUG: features dictionary for ', chan_title)
+                print(features)
+    finally:
+        store.save()
                 
     print(f'No more channels in {category} category to scrape. Moving on to next category.')
     
 #     dr.quit()
             
 
+def scrape_scheduled_batch(schedule, dr, budget=50):
+    '''
+    
+    Rescrape the channels most due for a refresh, according to the
+    crawl_scheduler database `schedule` (an open connection).
+    
+    At most `budget` channel pages are loaded. Each result is exported
+    to its category file, recorded in the snapshot store, and fed back
+    into the schedule, so popular, fast-changing channels come around
+    again sooner.
+    
+    '''
+    
+    window_rect=(0, 0, 800, 1200)
+    dr.set_window_rect(*window_rect)
+    
+    batch = crawl_scheduler.next_batch(schedule, budget)
+    print(f'{len(batch)} channels due for a scrape')
+    
+    store = snapshot_store.SnapshotStore.load()
+    
+    try:
+        for chan in batch:
+            
+            try:
+                features = scrape_channel_page(chan['chan_url'], dr)
+            except Exception as e:
+                print(f'{chan["title"]} scrape error: {e}')
+                features = {}
+            
+            if len(features.get('recent_eps', [])) == 0:
+                print(f'{chan["title"]} invalidly scraped. not exporting.')
+                crawl_scheduler.record_failure(schedule, chan['chan_url'])
+                continue
+            
+            if chan['category']:
+                export_channel_features(features, chan['category'])
+            crawl_scheduler.record_scrape(schedule, chan['chan_url'], features)
+            store.observe(features)
+    finally:
+        store.save()
+    
+
 def log_test():
     with open('../logs/scrape_log.txt', 'a') as log:
     
@@ -492,4 +869,8 @@ def log_test():
         log.write('\n')
         log.write(str(dt.datetime.now()))
         log.write('I want this to print')
-    log.close()
\ No newline at end of file
+    log.close()
+
+
+profiling.instrument_module(sys.modules[__name__],
+                           extras=['BeautifulSoup', 'time.sleep', 'requests.head', 'requests.get'])